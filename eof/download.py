@@ -22,17 +22,34 @@ https://earth.esa.int/documents/247904/349490/GMES_Sentinels_POD_Service_File_Fo
 See parsers for Sentinel file naming description
 """
 import os
-import glob
+import re
+import posixpath
+import uuid
+import json
 from zipfile import ZipFile
 import itertools
 import requests
-from multiprocessing.pool import ThreadPool
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 from dateutil.parser import parse
 from .scihubclient import ASFClient, ScihubGnssClient
 from .products import Sentinel, SentinelOrbit
 from .log import logger
 
 MAX_WORKERS = 6  # workers to download in parallel (for ASF backup)
+CHUNK_SIZE = 65536  # bytes written to disk per chunk while streaming downloads
+EOF_CACHE_FILENAME = ".eof_cache.json"  # maps SAFE names to the EOF covering them
+
+# Cheap name checks run before paying for the full product parsing
+_EOF_NAME_RE = re.compile(r"^S1[AB]_OPER_.*\.EOF$")
+_SAFE_EXTENSIONS = (".SAFE", ".zip")
+
+# Shared session so that listing and download requests reuse keep-alive connections
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://", HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS)
+)
 
 
 def download_eofs(orbit_dts=None, missions=None, sentinel_file=None, save_dir=".",
@@ -54,7 +71,6 @@ def download_eofs(orbit_dts=None, missions=None, sentinel_file=None, save_dir=".
         ValueError - for missions argument not being one of 'S1A', 'S1B',
             having different lengths, or `sentinel_file` being invalid
     """
-    # TODO: condense list of same dates, different hours?
     if missions and all(m not in ("S1A", "S1B") for m in missions):
         raise ValueError('missions argument must be "S1A" or "S1B"')
     if sentinel_file:
@@ -66,7 +82,11 @@ def download_eofs(orbit_dts=None, missions=None, sentinel_file=None, save_dir=".
         missions = itertools.repeat(None)
 
     # First make sure all are datetimes if given string
-    orbit_dts = [parse(dt) if isinstance(dt, str) else dt for dt in orbit_dts]
+    orbit_dts = [_parse_orbit_dt(dt) for dt in orbit_dts]
+    # Drop repeated requests, keeping the first-seen order
+    unique_orbits = list(dict.fromkeys(zip(orbit_dts, missions)))
+    orbit_dts = [dt for dt, _ in unique_orbits]
+    missions = [mission for _, mission in unique_orbits]
 
     filenames = []
     scihub_successful = False
@@ -74,42 +94,86 @@ def download_eofs(orbit_dts=None, missions=None, sentinel_file=None, save_dir=".
 
     # First, check that Scihub isn't having issues
     if client.server_is_up():
-        # try to search on scihub
-        if sentinel_file:
-            query = client.query_orbit_for_product(sentinel_file, orbit_type=orbit_type)
-        else:
-            query = client.query_orbit_by_dt(orbit_dts, missions, orbit_type=orbit_type)
-
-        if query:
-            result = client.download_all(query, directory_path=save_dir)
-            filenames.extend(
-                item['path'] for item in result.downloaded.values()
-            )
-            scihub_successful = True
+        # Search on scihub, starting each download as soon as its orbit is found.
+        # Queries and downloads share the client's limit on concurrent connections.
+        n_query_workers = max(1, client.max_workers // 2)
+        n_download_workers = max(1, client.max_workers - n_query_workers)
+        uuids = set()
+        with ThreadPoolExecutor(max_workers=n_download_workers) as pool:
+            download_futures = []
+            for result in client.iter_orbits_by_dt(
+                orbit_dts, missions, orbit_type=orbit_type, max_workers=n_query_workers
+            ):
+                for uuid in result.keys() - uuids:
+                    uuids.add(uuid)
+                    download_futures.append(
+                        pool.submit(_download_scihub_orbit, client, uuid, save_dir)
+                    )
+            for future in as_completed(download_futures):
+                try:
+                    filenames.extend(future.result())
+                except Exception as e:
+                    logger.error("Failed to download orbit from Scihub: %s", e)
+        scihub_successful = bool(filenames)
 
     # For failures from scihub, try ASF
     if not scihub_successful:
         logger.warning("Scihub failed, trying ASF")
-        asfclient = ASFClient()
+        asfclient = ASFClient(session=_SESSION)
         urls = asfclient.get_download_urls(orbit_dts, missions, orbit_type=orbit_type)
-        # Download and save all links in parallel
-        pool = ThreadPool(processes=MAX_WORKERS)
-        result_url_dict = {
-            pool.apply_async(_download_and_write, (url,)): url
-            for url in urls
-        }
-
-        for result, url in result_url_dict.items():
-            cur_filenames = result.get()
-            if cur_filenames is None:
-                logger.error("Failed to download orbit for %s", url)
-            else:
-                logger.info("Finished %s, saved to %s", url, cur_filenames)
-                filenames.append(cur_filenames)
+        # Scenes from the same day usually share one orbit file: fetch it once
+        urls = list(dict.fromkeys(urls))
+        # Download and save all links in parallel, collecting them as they finish
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+            future_to_url = {
+                pool.submit(_download_and_write, url, save_dir): url for url in urls
+            }
+            for future in as_completed(future_to_url):
+                url = future_to_url[future]
+                try:
+                    cur_filename = future.result()
+                except Exception as e:
+                    logger.error("Failed to download orbit for %s: %s", url, e)
+                    continue
+                logger.info("Finished %s, saved to %s", url, cur_filename)
+                filenames.append(cur_filename)
 
     return filenames
 
 
+def _download_scihub_orbit(client, uuid, save_dir):
+    """Download one Scihub orbit product
+
+    Goes through `download_all` to keep sentinelsat's retries of failed
+    downloads and its handling of archived (LTA) products.
+
+    Returns:
+        list[str]: Filenames of the downloaded product (empty if it failed)
+    """
+    result = client.download_all([uuid], directory_path=save_dir)
+    for failed_uuid, info in result.failed.items():
+        logger.error(
+            "Failed to download orbit %s from Scihub: %s",
+            failed_uuid,
+            info.get("exception"),
+        )
+    return [item["path"] for item in result.downloaded.values()]
+
+
+def _parse_orbit_dt(dt):
+    """Convert `dt` to a datetime if it is a string
+
+    Tries the Sentinel file name format with strptime before falling
+    back to the (much slower) general purpose dateutil parser.
+    """
+    if not isinstance(dt, str):
+        return dt
+    try:
+        return datetime.strptime(dt, Sentinel.TIME_FMT)
+    except ValueError:
+        return parse(dt)
+
+
 def _download_and_write(url, save_dir="."):
     """Wrapper function to run the link downloading in parallel
 
@@ -118,19 +182,30 @@ def _download_and_write(url, save_dir="."):
         save_dir (str): directory to save the EOF files into
 
     Returns:
-        list[str]: Filenames to which the orbit files have been saved
+        str: Filename to which the orbit file has been saved
     """
-    fname = os.path.join(save_dir, url.split("/")[-1])
-    if os.path.isfile(fname):
+    fname = os.path.join(save_dir, posixpath.basename(url))
+    if os.path.exists(fname):
         logger.info("%s already exists, skipping download.", url)
-        return [fname]
-
+        return fname
+
+    # Stream into a uniquely named temporary file so an interrupted download
+    # is never mistaken for a complete one, and never blocks the next run.
+    # Mode 0o666 lets the umask set the final permissions, as open() would.
+    fname_part = "{}.{}.part".format(fname, uuid.uuid4().hex)
+    flags = os.O_CREAT | os.O_EXCL | os.O_WRONLY | getattr(os, "O_BINARY", 0)
+    fd = os.open(fname_part, flags, 0o666)
     logger.info("Downloading %s", url)
-    response = requests.get(url)
-    response.raise_for_status()
-    logger.info("Saving to %s", fname)
-    with open(fname, "wb") as f:
-        f.write(response.content)
+    try:
+        with os.fdopen(fd, "wb") as f, _SESSION.get(url, stream=True) as response:
+            response.raise_for_status()
+            logger.info("Saving to %s", fname)
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+        os.replace(fname_part, fname)
+    except BaseException:
+        os.remove(fname_part)
+        raise
     if fname.endswith(".zip"):
         _extract_zip(fname, save_dir=save_dir)
         # Pass the unzipped file ending in ".EOF", not the ".zip"
@@ -156,26 +231,83 @@ def _extract_zip(fname_zipped, save_dir=None, delete=True):
         os.remove(fname_zipped)
 
 
+def _scan_names(path, name_filter):
+    """Yields paths of entries in `path` whose name passes `name_filter`"""
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if name_filter(entry.name):
+                    yield entry.path
+    except FileNotFoundError:
+        return
+
+
 def find_current_eofs(cur_path):
     """Returns a list of SentinelOrbit objects located in `cur_path`"""
     return sorted(
-        [
-            SentinelOrbit(filename)
-            for filename in glob.glob(os.path.join(cur_path, "S1*OPER*.EOF"))
-        ]
+        SentinelOrbit(filename)
+        for filename in _scan_names(cur_path, _EOF_NAME_RE.match)
     )
 
 
 def find_unique_safes(search_path):
-    file_set = set()
-    for filename in glob.glob(os.path.join(search_path, "S1*")):
-        try:
-            parsed_file = Sentinel(filename)
-        except ValueError:  # Doesn't match a sentinel file
-            logger.debug("Skipping {}, not a Sentinel 1 file".format(filename))
-            continue
-        file_set.add(parsed_file)
-    return file_set
+    return {
+        Sentinel(filename)
+        for filename in _scan_names(search_path, _is_safe_name)
+    }
+
+
+def _is_safe_name(name):
+    """Checks for a Sentinel-1 product name ending in .SAFE or .zip"""
+    return name.endswith(_SAFE_EXTENSIONS) and Sentinel.looks_like(name)
+
+
+def _find_covering_orbits(dts, orbits):
+    """Find, for each datetime in `dts`, an orbit whose validity window contains it
+
+    Both inputs are sorted and the orbits are swept once, rather than testing
+    every orbit against every datetime.
+
+    Returns:
+        list[SentinelOrbit or None]: covering orbit for each entry of `dts`
+    """
+    orbits = sorted(orbits, key=lambda o: o.start_time)
+    covering = [None] * len(dts)
+    latest, idx = None, 0
+    for i in sorted(range(len(dts)), key=dts.__getitem__):
+        dt = dts[i]
+        # Of the orbits starting before `dt`, track the one ending last
+        # (strict bounds, matching SentinelOrbit.__contains__)
+        while idx < len(orbits) and orbits[idx].start_time < dt:
+            if latest is None or orbits[idx].stop_time > latest.stop_time:
+                latest = orbits[idx]
+            idx += 1
+        if latest is not None and latest.stop_time > dt:
+            covering[i] = latest
+    return covering
+
+
+def _load_eof_cache(save_dir):
+    """Load the {SAFE name: EOF name} cache saved by previous runs in `save_dir`"""
+    try:
+        with open(os.path.join(save_dir, EOF_CACHE_FILENAME)) as f:
+            eof_cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    # Ignore anything in a valid JSON file that is not a {str: str} mapping
+    if not isinstance(eof_cache, dict):
+        return {}
+    return {
+        k: v for k, v in eof_cache.items() if isinstance(k, str) and isinstance(v, str)
+    }
+
+
+def _write_eof_cache(save_dir, eof_cache):
+    try:
+        with open(os.path.join(save_dir, EOF_CACHE_FILENAME), "w") as f:
+            json.dump(eof_cache, f, indent=2, sort_keys=True)
+    except OSError as e:
+        logger.debug("Could not write EOF cache to %s: %s", save_dir, e)
 
 
 def find_scenes_to_download(search_path="./", save_dir="./"):
@@ -184,28 +316,47 @@ def find_scenes_to_download(search_path="./", save_dir="./"):
     missions = []
     # Check for already-downloaded orbit files, skip ones we have
     current_eofs = find_current_eofs(save_dir)
+    current_eof_names = {os.path.basename(orbit.filename) for orbit in current_eofs}
+    eof_cache = _load_eof_cache(save_dir)
+
+    # Test the scenes not found in the cache against the current EOFs in one batch
+    safes = find_unique_safes(search_path)
+    uncached = [
+        parsed_file
+        for parsed_file in safes
+        if eof_cache.get(os.path.basename(parsed_file.filename)) not in current_eof_names
+    ]
+    covering = _find_covering_orbits([p.start_time for p in uncached], current_eofs)
+    cache_updated = False
+    for parsed_file, orbit in zip(uncached, covering):
+        if orbit is not None:
+            safe_name = os.path.basename(parsed_file.filename)
+            eof_cache[safe_name] = os.path.basename(orbit.filename)
+            cache_updated = True
 
     # Now loop through each Sentinel scene in search_path
-    for parsed_file in find_unique_safes(search_path):
+    for parsed_file in safes:
         if parsed_file.start_time in orbit_dts:
             # start_time is a datetime, already found
             continue
-        if any(parsed_file.start_time in orbit for orbit in current_eofs):
+        safe_name = os.path.basename(parsed_file.filename)
+        if eof_cache.get(safe_name) in current_eof_names:
             logger.info(
-                "Skipping {}, already have EOF file".format(
-                    os.path.splitext(parsed_file.filename)[0]
-                )
+                "Skipping %s, already have EOF file",
+                os.path.splitext(parsed_file.filename)[0],
             )
             continue
 
         logger.info(
-            "Downloading precise orbits for {} on {}".format(
-                parsed_file.mission, parsed_file.start_time.strftime("%Y-%m-%d")
-            )
+            "Downloading precise orbits for %s on %s",
+            parsed_file.mission,
+            parsed_file.start_time.date(),
         )
         orbit_dts.append(parsed_file.start_time)
         missions.append(parsed_file.mission)
 
+    if cache_updated:
+        _write_eof_cache(save_dir, eof_cache)
     return orbit_dts, missions
 
 
@@ -37,9 +37,15 @@ class Base(object):
     """Base parser to illustrate expected interface/ minimum data available"""
 
     FILE_REGEX = None
+    _FILE_RE = None  # compiled FILE_REGEX, set for each subclass
     TIME_FMT = None
     _FIELD_MEANINGS = None
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.FILE_REGEX:
+            cls._FILE_RE = re.compile(cls.FILE_REGEX)
+
     def __init__(self, filename, verbose=False):
         """
         Extract data from filename
@@ -47,7 +53,9 @@ class Base(object):
             verbose (bool): print extra logging into about file loading
         """
         self.filename = filename
-        self.full_parse()  # Run a parse to check validity of filename
+        # Run a parse to check validity of filename, keeping the raw fields
+        self._fields = self.full_parse()
+        self._datetimes = {}
         self.verbose = verbose
 
     def __str__(self):
@@ -71,7 +79,7 @@ class Base(object):
         if not self.FILE_REGEX:
             raise NotImplementedError("Must define class FILE_REGEX to parse")
 
-        match = re.search(self.FILE_REGEX, self.filename)
+        match = self._FILE_RE.search(self.filename)
         if not match:
             raise ValueError(
                 "Invalid {} filename: {}".format(self.__class__.__name__, self.filename)
@@ -79,6 +87,11 @@ class Base(object):
         else:
             return match.groups()
 
+    @classmethod
+    def looks_like(cls, name):
+        """Checks if file name `name` starts with this product's naming, without parsing"""
+        return cls._FILE_RE is not None and cls._FILE_RE.match(name) is not None
+
     @property
     def field_meanings(self):
         """List the fields returned by full_parse()"""
@@ -87,7 +100,16 @@ class Base(object):
     def _get_field(self, fieldname):
         """Pick a specific field based on its name"""
         idx = self.field_meanings.index(fieldname)
-        return self.full_parse()[idx]
+        return self._fields[idx]
+
+    def _get_datetime(self, fieldname):
+        """Parse a datetime field on first access, then reuse it"""
+        try:
+            return self._datetimes[fieldname]
+        except KeyError:
+            dt = datetime.strptime(self._get_field(fieldname), self.TIME_FMT)
+            self._datetimes[fieldname] = dt
+            return dt
 
 
 class Sentinel(Base):
@@ -170,8 +192,7 @@ class Sentinel(Base):
             >>> print(s.start_time)
             2018-04-08 04:30:25
         """
-        start_time_str = self._get_field("start datetime")
-        return datetime.strptime(start_time_str, self.TIME_FMT)
+        return self._get_datetime("start datetime")
 
     @property
     def stop_time(self):
@@ -182,8 +203,7 @@ class Sentinel(Base):
             >>> print(s.stop_time)
             2018-04-08 04:30:53
         """
-        stop_time_str = self._get_field("stop datetime")
-        return datetime.strptime(stop_time_str, self.TIME_FMT)
+        return self._get_datetime("stop datetime")
 
     @property
     def polarization(self):
@@ -361,8 +381,7 @@ class SentinelOrbit(Base):
             >>> print(s.start_time)
             2019-12-31 22:59:42
         """
-        start_time_str = self._get_field("start datetime")
-        return datetime.strptime(start_time_str, self.TIME_FMT)
+        return self._get_datetime("start datetime")
 
     @property
     def stop_time(self):
@@ -373,8 +392,7 @@ class SentinelOrbit(Base):
             >>> print(s.stop_time)
             2020-01-02 00:59:42
         """
-        stop_time_str = self._get_field("stop datetime")
-        return datetime.strptime(stop_time_str, self.TIME_FMT)
+        return self._get_datetime("stop datetime")
 
     @property
     def created_time(self):
@@ -385,8 +403,7 @@ class SentinelOrbit(Base):
             >>> print(s.created_time)
             2020-01-21 12:06:54
         """
-        stop_time_str = self._get_field("created datetime")
-        return datetime.strptime(stop_time_str, self.TIME_FMT)
+        return self._get_datetime("created datetime")
 
     @property
     def orbit_type(self):
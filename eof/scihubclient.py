@@ -4,10 +4,13 @@ import os
 import logging
 import requests
 import datetime
-import operator
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Sequence
 
 from .products import SentinelOrbit, Sentinel as S1Product
+from .parsing import find_eof_links
 
 from sentinelsat import SentinelAPI
 from sentinelsat.exceptions import ServerError
@@ -26,20 +29,20 @@ def lastval_cover(
     data: Sequence[SentinelOrbit],
     margin: datetime.timedelta = datetime.timedelta(minutes=5),
 ) -> str:
-    candidates = [
-        item
-        for item in data
-        if item.start_time <= (t0 - margin) and item.stop_time >= (t1 + margin)
-    ]
-    if not candidates:
+    start_limit, stop_limit = t0 - margin, t1 + margin
+    # Keep the most recently created product covering the interval
+    best = None
+    for item in data:
+        if item.start_time <= start_limit and item.stop_time >= stop_limit:
+            if best is None or item.created_time > best.created_time:
+                best = item
+    if best is None:
         raise ValidityError(
             "none of the input products completely covers the requested "
             "time interval: [t0={}, t1={}]".format(t0, t1)
         )
 
-    candidates.sort(key=operator.attrgetter("created_time"), reverse=True)
-
-    return candidates[0].filename
+    return best.filename
 
 
 class OrbitSelectionError(RuntimeError):
@@ -49,15 +52,27 @@ class OrbitSelectionError(RuntimeError):
 class ScihubGnssClient:
     T0 = datetime.timedelta(days=1)
     T1 = datetime.timedelta(days=1)
+    # Search margin for restituted orbits, and the interval an orbit must cover
+    RESORB_MARGIN = datetime.timedelta(hours=1)
+    COVERAGE = datetime.timedelta(minutes=1)
+    DAY = datetime.timedelta(days=1)
 
     def __init__(
         self,
         user: str = "gnssguest",
         password: str = "gnssguest",
         api_url: str = "https://scihub.copernicus.eu/gnss/",
+        max_workers: int = 4,
         **kwargs
     ):
+        # SentinelAPI keeps a requests.Session, so parallel queries share connections
         self._api = SentinelAPI(user=user, password=password, api_url=api_url, **kwargs)
+        # Number of concurrent queries (Scihub limits connections per user)
+        self.max_workers = max_workers
+        # Results of `query_orbit`, keyed by its arguments
+        self._query_cache = {}
+        self._query_locks = {}
+        self._query_locks_lock = threading.Lock()
 
     def query_orbit(self, t0, t1, satellite_id: str, product_type: str = "AUX_POEORB"):
         assert satellite_id in {"S1A", "S1B"}
@@ -77,6 +92,18 @@ class ScihubGnssClient:
         products = self._api.query(**query_params)
         return products
 
+    def _query_orbit_cached(self, t0, t1, satellite_id: str, product_type: str):
+        key = (t0, t1, satellite_id, product_type)
+        # One lock per key so concurrent callers wait for a single request
+        with self._query_locks_lock:
+            lock = self._query_locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self._query_cache:
+                self._query_cache[key] = self.query_orbit(
+                    t0, t1, satellite_id, product_type=product_type
+                )
+        return self._query_cache[key]
+
     @staticmethod
     def _select_orbit(products, t0, t1):
         if not products:
@@ -93,6 +120,11 @@ class ScihubGnssClient:
         t0_margin: datetime.timedelta = T0,
         t1_margin: datetime.timedelta = T1,
     ):
+        """Query the Scihub api for the orbit covering a Sentinel-1 product.
+
+        See `query_orbit_by_dt` for the arguments. The precise orbit search
+        window is aligned to the UTC day of the product's start time.
+        """
         if isinstance(product, str):
             product = S1Product(product)
 
@@ -119,60 +151,93 @@ class ScihubGnssClient:
             missions (list[str]): list of mission names
             orbit_type (str, optional): Type of orbit to prefer in search. Defaults to "precise".
             t0_margin (datetime.timedelta, optional): Margin used in searching for early bound
-                for orbit.  Defaults to 1 day.
+                for precise orbits, subtracted from the start of the UTC day of each
+                orbit datetime (not from the datetime itself).  Defaults to 1 day.
             t1_margin (datetime.timedelta, optional): Margin used in searching for late bound
-                for orbit.  Defaults to 1 day.
+                for precise orbits, added to the end of the UTC day of each orbit
+                datetime.  Defaults to 1 day.
+
+        Restituted orbits are searched within `RESORB_MARGIN` of each datetime.
 
         Returns:
             query (dict): API info from scihub with the requested products
         """
-        remaining_dates = []
         query = {}
-        for dt, mission in zip(orbit_dts, missions):
-            found_result = False
-            # Only check for previse orbits if that is what we want
-            if orbit_type == "precise":
-                products = self.query_orbit(
-                    dt - t0_margin,
-                    dt + t1_margin,
-                    mission,
-                    product_type="AUX_POEORB",
-                )
-                try:
-                    result = self._select_orbit(
-                        products, dt, dt + datetime.timedelta(minutes=1)
-                    )
-                except ValidityError:
-                    result = None
-            else:
-                result = None
+        for result in self.iter_orbits_by_dt(
+            orbit_dts,
+            missions,
+            orbit_type=orbit_type,
+            t0_margin=t0_margin,
+            t1_margin=t1_margin,
+        ):
+            query.update(result)
+        return query
 
-            if result:
-                found_result = True
-                query.update(result)
-            else:
-                # try with RESORB
-                products = self.query_orbit(
-                    dt - datetime.timedelta(hours=1),
-                    dt + datetime.timedelta(hours=1),
-                    mission,
-                    product_type="AUX_RESORB",
-                )
-                result = (
-                    self._select_orbit(products, dt, dt + datetime.timedelta(minutes=1))
-                    if products
-                    else None
-                )
-                if result:
-                    found_result = True
-                    query.update(result)
+    def iter_orbits_by_dt(
+        self,
+        orbit_dts,
+        missions,
+        orbit_type: str = "precise",
+        t0_margin: datetime.timedelta = T0,
+        t1_margin: datetime.timedelta = T1,
+        max_workers: int = None,
+    ):
+        """Same as `query_orbit_by_dt`, but yields each date's products as soon as found.
 
-            if not found_result:
-                remaining_dates.append((mission, dt))
+        Lets callers start downloading while the remaining dates are queried.
+        As there, `t0_margin`/`t1_margin` extend the UTC day of each datetime.
+        `max_workers` overrides the number of concurrent queries.
+
+        Yields:
+            dict: API info from scihub for the product covering one date
+        """
+        remaining_dates = []
+        max_workers = max_workers or self.max_workers
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            future_to_orbit = {
+                pool.submit(
+                    self._query_one, mission, dt, orbit_type, t0_margin, t1_margin
+                ): (mission, dt)
+                for dt, mission in zip(orbit_dts, missions)
+            }
+            for future in as_completed(future_to_orbit):
+                result = future.result()
+                if result:
+                    yield result
+                else:
+                    remaining_dates.append(future_to_orbit[future])
 
         if remaining_dates:
             logger.warning("The following dates were not found: %s", remaining_dates)
-        return query
+
+    def _query_one(self, mission, dt, orbit_type, t0_margin, t1_margin):
+        """Find the orbit product for one mission/datetime, falling back to RESORB"""
+        # Only check for previse orbits if that is what we want
+        if orbit_type == "precise":
+            # POEORBs are produced daily, so query the whole UTC day: all
+            # dates from the same day then share one request
+            day_start = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+            products = self._query_orbit_cached(
+                day_start - t0_margin,
+                day_start + self.DAY + t1_margin,
+                mission,
+                product_type="AUX_POEORB",
+            )
+            try:
+                result = self._select_orbit(products, dt, dt + self.COVERAGE)
+            except ValidityError:
+                result = None
+            if result:
+                return result
+
+        # try with RESORB
+        products = self._query_orbit_cached(
+            dt - self.RESORB_MARGIN,
+            dt + self.RESORB_MARGIN,
+            mission,
+            product_type="AUX_RESORB",
+        )
+        return self._select_orbit(products, dt, dt + self.COVERAGE) if products else None
 
     def download(self, uuid, **kwargs):
         """Download a single orbit product.
@@ -193,7 +258,9 @@ class ScihubGnssClient:
     def server_is_up(self):
         """Ping the ESA server using sentinelsat to verify the connection."""
         try:
-            self._api.query(producttype="AUX_POEORB", platformserialidentifier="S1A")
+            # Only ask for the number of results: a full query would page
+            # sequentially through every POEORB product ever made
+            self._api.count(producttype="AUX_POEORB", platformserialidentifier="S1A")
             return True
         except ServerError as e:
             logger.warning("Cannot connect to the server: %s", e)
@@ -205,41 +272,51 @@ class ASFClient:
     res_url = "https://s1qc.asf.alaska.edu/aux_resorb/"
     urls = {"precise": precise_url, "restituted": res_url}
     eof_lists = {"precise": None, "restituted": None}
+    # Seconds before the in-memory lists are fetched again from the server
+    EOF_LIST_TTL = 3600
+    _eof_list_times = {"precise": 0.0, "restituted": 0.0}
+
+    def __init__(self, session=None):
+        self._session = session if session is not None else requests.Session()
 
     def get_full_eof_list(self, orbit_type="precise", max_dt=None):
         """Get the list of orbit files from the ASF server."""
-        from .parsing import EOFLinkFinder
-
         if orbit_type not in self.urls.keys():
             raise ValueError("Unknown orbit type: {}".format(orbit_type))
 
         if self.eof_lists.get(orbit_type) is not None:
-            return self.eof_lists[orbit_type]
+            list_age = time.monotonic() - self._eof_list_times[orbit_type]
+            if list_age < self.EOF_LIST_TTL:
+                return self.eof_lists[orbit_type]
+            # The disk cache holds this same list, so go back to the server
+            logger.info("Cached %s EOF list has expired", orbit_type)
         # Try to see if we have the list of EOFs in the cache
         elif os.path.exists(self._get_filename_cache_path(orbit_type)):
             eof_list = self._get_cached_filenames(orbit_type)
             # Need to clear it if it's older than what we're looking for
             max_saved = max([e.start_time for e in eof_list])
             if max_saved < max_dt:
-                logger.warning("Clearing cached {} EOF list:".format(orbit_type))
-                logger.warning(
-                    "{} is older than requested {}".format(max_saved, max_dt)
-                )
+                logger.warning("Clearing cached %s EOF list:", orbit_type)
+                logger.warning("%s is older than requested %s", max_saved, max_dt)
                 self._clear_cache(orbit_type)
             else:
                 logger.info("Using cached EOF list")
-                self.eof_lists[orbit_type] = eof_list
+                self._set_eof_list(orbit_type, eof_list)
                 return eof_list
 
         logger.info("Downloading all filenames from ASF (may take awhile)")
-        resp = requests.get(self.urls.get(orbit_type))
-        finder = EOFLinkFinder()
-        finder.feed(resp.text)
-        eof_list = [SentinelOrbit(f) for f in finder.eof_links]
-        self.eof_lists[orbit_type] = eof_list
+        resp = self._session.get(self.urls.get(orbit_type))
+        resp.raise_for_status()
+        eof_list = [SentinelOrbit(f) for f in find_eof_links(resp.text)]
+        self._set_eof_list(orbit_type, eof_list)
         self._write_cached_filenames(orbit_type, eof_list)
         return eof_list
 
+    def _set_eof_list(self, orbit_type, eof_list):
+        """Store the list in memory, shared by all ASFClient instances"""
+        self.eof_lists[orbit_type] = eof_list
+        self._eof_list_times[orbit_type] = time.monotonic()
+
     def get_download_urls(self, orbit_dts, missions, orbit_type="precise"):
         """Find the URL for an orbit file covering the specified datetime
 
@@ -250,35 +327,38 @@ class ASFClient:
             missions (list[str]): specify S1A or S1B
 
         Returns:
-            str: URL for the orbit file
+            list[str]: URLs for the orbit files
         """
-        eof_list = self.get_full_eof_list(orbit_type=orbit_type, max_dt=max(orbit_dts))
-        # Split up for quicker parsing of the latest one
-        mission_to_eof_list = {
-            "S1A": [eof for eof in eof_list if eof.mission == "S1A"],
-            "S1B": [eof for eof in eof_list if eof.mission == "S1B"],
-        }
-        remaining_orbits = []
+        # Precise orbits fall back to restituted for any dates not covered
+        orbit_types = ["precise", "restituted"] if orbit_type == "precise" else [orbit_type]
+        remaining_orbits = list(zip(orbit_dts, missions))
         urls = []
-        for dt, mission in zip(orbit_dts, missions):
-            try:
-                filename = lastval_cover(dt, dt, mission_to_eof_list[mission])
-                urls.append(self.urls[orbit_type] + filename)
-            except ValidityError:
-                remaining_orbits.append((dt, mission))
-
-        if remaining_orbits:
-            logger.warning("The following dates were not found: %s", remaining_orbits)
-            if orbit_type == "precise":
+        for cur_orbit_type in orbit_types:
+            if cur_orbit_type != orbit_type:
                 logger.warning(
                     "Attempting to download the restituted orbits for these dates."
                 )
-                remaining_dts, remaining_missions = zip(*remaining_orbits)
-                urls.extend(
-                    self.get_download_urls(
-                        remaining_dts, remaining_missions, orbit_type="restituted"
-                    )
-                )
+            eof_list = self.get_full_eof_list(
+                orbit_type=cur_orbit_type,
+                max_dt=max(dt for dt, _ in remaining_orbits),
+            )
+            # Split up for quicker parsing of the latest one, in a single pass
+            mission_to_eof_list = {"S1A": [], "S1B": []}
+            for eof in eof_list:
+                mission_to_eof_list[eof.mission].append(eof)
+
+            base_url = self.urls[cur_orbit_type]
+            not_found = []
+            for dt, mission in remaining_orbits:
+                try:
+                    filename = lastval_cover(dt, dt, mission_to_eof_list[mission])
+                    urls.append(base_url + filename)
+                except ValidityError:
+                    not_found.append((dt, mission))
+            remaining_orbits = not_found
+            if not remaining_orbits:
+                break
+            logger.warning("The following dates were not found: %s", remaining_orbits)
 
         return urls
 
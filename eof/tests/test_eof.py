@@ -3,10 +3,17 @@ import tempfile
 import shutil
 import datetime
 import os
+import stat
+import json
+import requests
 import responses
 
 from unittest import mock
 from eof import download
+from eof import products
+from eof.products import SentinelOrbit
+from eof.scihubclient import ASFClient, ScihubGnssClient
+from sentinelsat.exceptions import ServerError
 
 
 class TestEOF(unittest.TestCase):
@@ -84,6 +91,13 @@ class TestEOF(unittest.TestCase):
             )
             open(name1, "w").close()
             open(name2, "w").close()
+            # Not Sentinel-1 product names: skipped
+            for other in (
+                "S1A_notes.zip",
+                "backup_" + os.path.basename(name1),
+                os.path.basename(name2).replace(".zip", ".kml"),
+            ):
+                open(os.path.join(temp_dir, other), "w").close()
             orbit_dates, missions = download.find_scenes_to_download(
                 search_path=temp_dir
             )
@@ -101,6 +115,158 @@ class TestEOF(unittest.TestCase):
             # Clean up temp dir
             shutil.rmtree(temp_dir)
 
+    def test_find_scenes_to_download_existing_eof(self):
+        try:
+            temp_dir = tempfile.mkdtemp()
+            name1 = "S1A_IW_SLC__1SDV_20180502T043026_20180502T043054_021721_025793_5C18.zip"
+            name2 = "S1B_IW_SLC__1SDV_20180520T043026_20180520T043054_011036_014389_67D8.zip"
+            eof_name = "S1A_OPER_AUX_POEORB_OPOD_20180522T120730_V20180501T225942_20180503T005942.EOF"
+            for name in (name1, name2, eof_name):
+                open(os.path.join(temp_dir, name), "w").close()
+
+            for _ in range(2):
+                # Second pass reads the coverage from the saved cache
+                orbit_dates, missions = download.find_scenes_to_download(
+                    search_path=temp_dir, save_dir=temp_dir
+                )
+                self.assertEqual(orbit_dates, [datetime.datetime(2018, 5, 20, 4, 30, 26)])
+                self.assertEqual(missions, ["S1B"])
+
+            with open(os.path.join(temp_dir, download.EOF_CACHE_FILENAME)) as f:
+                self.assertEqual(json.load(f), {name1: eof_name})
+        finally:
+            shutil.rmtree(temp_dir)
+
+    @mock.patch("eof.download.ScihubGnssClient.server_is_up", return_value=True)
+    @mock.patch("eof.download.ScihubGnssClient.iter_orbits_by_dt")
+    @mock.patch("eof.download.ScihubGnssClient.download_all")
+    def test_download_eofs_scihub(self, download_all, iter_orbits_by_dt, server_is_up):
+        uuid = "a758ad6d-b718-4dff-a1b2-822874ca4017"
+        eof_path = "S1A_OPER_AUX_POEORB_OPOD_20180522T120730_V20180501T225942_20180503T005942.EOF"
+        # Both dates are covered by the same product
+        iter_orbits_by_dt.return_value = iter([{uuid: {}}, {uuid: {}}])
+        download_all.return_value = mock.Mock(
+            downloaded={uuid: {"path": eof_path}}, failed={}
+        )
+
+        orbit_dates = [
+            datetime.datetime(2018, 5, 2, 4, 30, 26),
+            datetime.datetime(2018, 5, 2, 16, 10, 5),
+        ]
+        filenames = download.download_eofs(orbit_dates, missions=["S1A", "S1A"])
+        self.assertEqual(filenames, [eof_path])
+        download_all.assert_called_once_with([uuid], directory_path=".")
+
+    @mock.patch("eof.download.ScihubGnssClient.server_is_up", return_value=True)
+    @mock.patch("eof.download.ScihubGnssClient.iter_orbits_by_dt")
+    @mock.patch("eof.download.ScihubGnssClient.download_all")
+    @mock.patch("eof.download.ASFClient.get_download_urls", return_value=[])
+    def test_download_eofs_scihub_fails(
+        self, get_download_urls, download_all, iter_orbits_by_dt, server_is_up
+    ):
+        iter_orbits_by_dt.return_value = iter([{"uuid1": {}}, {"uuid2": {}}])
+        download_all.side_effect = ServerError("download failed")
+
+        orbit_dates = [
+            datetime.datetime(2018, 5, 2, 4, 30, 26),
+            datetime.datetime(2018, 5, 20, 4, 30, 26),
+        ]
+        filenames = download.download_eofs(orbit_dates, missions=["S1A", "S1A"])
+        self.assertEqual(filenames, [])
+        self.assertEqual(download_all.call_count, 2)
+        # Nothing came from Scihub, so ASF is tried
+        get_download_urls.assert_called_once()
+
+    @responses.activate
+    def test_download_and_write_stale_part(self):
+        eof_name = "S1A_OPER_AUX_POEORB_OPOD_20180522T120730_V20180501T225942_20180503T005942.EOF"
+        eof_url = "https://s1qc.asf.alaska.edu/aux_poeorb/" + eof_name
+        responses.add(responses.GET, eof_url, body=self.sample_eof, status=200)
+        try:
+            temp_dir = tempfile.mkdtemp()
+            # Left over by an interrupted run: must not block the download
+            stale_part = os.path.join(temp_dir, eof_name + ".part")
+            open(stale_part, "w").close()
+            eof_path = os.path.join(temp_dir, eof_name)
+            self.assertEqual(download._download_and_write(eof_url, temp_dir), eof_path)
+            with open(eof_path) as f:
+                self.assertEqual(f.read(), self.sample_eof)
+            self.assertEqual(sorted(os.listdir(temp_dir)), [eof_name, eof_name + ".part"])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    @responses.activate
+    def test_download_and_write_mode(self):
+        eof_name = "S1A_OPER_AUX_POEORB_OPOD_20180522T120730_V20180501T225942_20180503T005942.EOF"
+        eof_url = "https://s1qc.asf.alaska.edu/aux_poeorb/" + eof_name
+        responses.add(responses.GET, eof_url, body=self.sample_eof, status=200)
+        try:
+            temp_dir = tempfile.mkdtemp()
+            # Compare against a file written with open(), which follows the umask
+            reference = os.path.join(temp_dir, "reference")
+            open(reference, "w").close()
+            eof_path = download._download_and_write(eof_url, temp_dir)
+            self.assertEqual(
+                stat.S_IMODE(os.stat(eof_path).st_mode),
+                stat.S_IMODE(os.stat(reference).st_mode),
+            )
+        finally:
+            shutil.rmtree(temp_dir)
+
+    @responses.activate
+    def test_download_and_write_error_cleanup(self):
+        eof_url = "https://s1qc.asf.alaska.edu/aux_poeorb/S1A_OPER_AUX_POEORB_OPOD_20180522T120730_V20180501T225942_20180503T005942.EOF"  # noqa
+        responses.add(responses.GET, eof_url, status=500)
+        try:
+            temp_dir = tempfile.mkdtemp()
+            self.assertRaises(
+                requests.HTTPError, download._download_and_write, eof_url, temp_dir
+            )
+            self.assertEqual(os.listdir(temp_dir), [])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_load_eof_cache_not_a_dict(self):
+        try:
+            temp_dir = tempfile.mkdtemp()
+            cache_file = os.path.join(temp_dir, download.EOF_CACHE_FILENAME)
+            with open(cache_file, "w") as f:
+                f.write("[]")
+            self.assertEqual(download._load_eof_cache(temp_dir), {})
+
+            # Entries that are not str -> str are dropped
+            with open(cache_file, "w") as f:
+                json.dump({"a.zip": ["x"], "b.zip": None, "c.zip": "c.EOF"}, f)
+            self.assertEqual(download._load_eof_cache(temp_dir), {"c.zip": "c.EOF"})
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_find_covering_orbits(self):
+        long_orbit = SentinelOrbit(
+            "S1A_OPER_AUX_POEORB_OPOD_20180522T120730_V20180501T225942_20180503T005942.EOF"
+        )
+        short_orbit = SentinelOrbit(
+            "S1A_OPER_AUX_RESORB_OPOD_20180502T070000_V20180502T010000_20180502T040000.EOF"
+        )
+        dts = [
+            datetime.datetime(2018, 5, 4),
+            datetime.datetime(2018, 5, 2, 4, 30),
+            datetime.datetime(2018, 5, 1),
+            datetime.datetime(2018, 5, 2, 2),
+        ]
+        covering = download._find_covering_orbits(dts, [long_orbit, short_orbit])
+        self.assertEqual(covering, [None, long_orbit, None, long_orbit])
+
+    def test_product_subclass_regex(self):
+        class Orbit(products.Base):
+            FILE_REGEX = r"(S1A|S1B)_OPER_AUX_(\w{6})"
+            _FIELD_MEANINGS = ("mission", "orbit type")
+
+        orbit = Orbit("S1A_OPER_AUX_POEORB_OPOD.EOF")
+        self.assertEqual(orbit._get_field("orbit type"), "POEORB")
+        self.assertTrue(Orbit.looks_like("S1B_OPER_AUX_RESORB"))
+        self.assertFalse(Orbit.looks_like("old_S1B_OPER_AUX_RESORB"))
+
     def test_download_eofs_errors(self):
         orbit_dates = [datetime.datetime(2018, 5, 2, 4, 30, 26)]
         self.assertRaises(
@@ -142,6 +308,139 @@ class TestEOF(unittest.TestCase):
     #     finally:
     #         shutil.rmtree(temp_dir)
 
+    @responses.activate
+    @mock.patch("eof.download.ScihubGnssClient.server_is_up", return_value=False)
+    @mock.patch("eof.download.ASFClient.get_download_urls")
+    def test_download_eofs_asf(self, get_download_urls, server_is_up):
+        eof_name = "S1A_OPER_AUX_POEORB_OPOD_20180522T120730_V20180501T225942_20180503T005942.EOF"
+        eof_url = "https://s1qc.asf.alaska.edu/aux_poeorb/" + eof_name
+        # Both scenes are covered by the same orbit file
+        get_download_urls.return_value = [eof_url, eof_url]
+        responses.add(responses.GET, eof_url, body=self.sample_eof, status=200)
+
+        orbit_dates = [
+            datetime.datetime(2018, 5, 2, 4, 30, 26),
+            datetime.datetime(2018, 5, 2, 4, 30, 51),
+        ]
+        try:
+            temp_dir = tempfile.mkdtemp()
+            eof_path = os.path.join(temp_dir, eof_name)
+            filenames = download.download_eofs(
+                orbit_dates, missions=["S1A", "S1A"], save_dir=temp_dir
+            )
+            self.assertEqual(filenames, [eof_path])
+            self.assertEqual(len(responses.calls), 1)
+            with open(eof_path) as f:
+                self.assertEqual(f.read(), self.sample_eof)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_query_orbit_by_dt_same_day(self):
+        client = ScihubGnssClient()
+        products = {
+            "a758ad6d-b718-4dff-a1b2-822874ca4017": {
+                "identifier": "S1A_OPER_AUX_POEORB_OPOD_20180522T120730_V20180501T225942_20180503T005942"
+            }
+        }
+        orbit_dates = [
+            datetime.datetime(2018, 5, 2, 4, 30, 26),
+            datetime.datetime(2018, 5, 2, 16, 10, 5),
+        ]
+        with mock.patch.object(client._api, "query", return_value=products) as query:
+            result = client.query_orbit_by_dt(orbit_dates, ["S1A", "S1A"])
+        self.assertEqual(result, products)
+        query.assert_called_once()
+
+    def test_asf_download_urls_restituted_fallback(self):
+        eof_lists = {
+            "precise": [
+                SentinelOrbit(
+                    "S1A_OPER_AUX_POEORB_OPOD_20180522T120730_V20180501T225942_20180503T005942.EOF"
+                )
+            ],
+            "restituted": [
+                SentinelOrbit(
+                    "S1A_OPER_AUX_RESORB_OPOD_20180520T070000_V20180520T010000_20180520T040000.EOF"
+                )
+            ],
+        }
+        client = ASFClient()
+        with mock.patch.object(
+            client,
+            "get_full_eof_list",
+            side_effect=lambda orbit_type, max_dt: eof_lists[orbit_type],
+        ):
+            urls = client.get_download_urls(
+                [datetime.datetime(2018, 5, 2, 4, 30), datetime.datetime(2018, 5, 20, 2)],
+                ["S1A", "S1A"],
+            )
+        self.assertEqual(
+            urls,
+            [
+                ASFClient.precise_url + eof_lists["precise"][0].filename,
+                ASFClient.res_url + eof_lists["restituted"][0].filename,
+            ],
+        )
+
+    def test_asf_eof_list_expires(self):
+        eof_name = "S1A_OPER_AUX_POEORB_OPOD_20180522T120730_V20180501T225942_20180503T005942.EOF"
+        session = mock.Mock()
+        session.get.return_value.text = '<a href="{}">'.format(eof_name)
+        max_dt = datetime.datetime(2018, 5, 1)
+        try:
+            temp_dir = tempfile.mkdtemp()
+            with mock.patch.dict(os.environ, {"XDG_CACHE_HOME": temp_dir}), \
+                    mock.patch.dict(ASFClient.eof_lists, {"precise": None}), \
+                    mock.patch.dict(ASFClient._eof_list_times, {"precise": 0.0}), \
+                    mock.patch("eof.scihubclient.time.monotonic") as monotonic:
+                client = ASFClient(session=session)
+                monotonic.return_value = 10000.0
+                client.get_full_eof_list(max_dt=max_dt)
+                # Still fresh: served from memory
+                monotonic.return_value += ASFClient.EOF_LIST_TTL - 1
+                client.get_full_eof_list(max_dt=max_dt)
+                self.assertEqual(session.get.call_count, 1)
+                # Expired: fetched again rather than re-read from the disk cache
+                monotonic.return_value += 2
+                eof_list = client.get_full_eof_list(max_dt=max_dt)
+                self.assertEqual(session.get.call_count, 2)
+                self.assertEqual([e.filename for e in eof_list], [eof_name])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_server_is_up(self):
+        client = ScihubGnssClient()
+        with mock.patch.object(client._api, "count", return_value=1) as count:
+            self.assertTrue(client.server_is_up())
+        count.assert_called_once()
+        with mock.patch.object(client._api, "count", side_effect=ServerError("down")):
+            self.assertFalse(client.server_is_up())
+
+    @responses.activate
+    @mock.patch("eof.download.ScihubGnssClient.server_is_up", return_value=False)
+    @mock.patch("eof.download.ASFClient.get_download_urls")
+    def test_download_eofs_asf_partial_failure(self, get_download_urls, server_is_up):
+        good_name = "S1A_OPER_AUX_POEORB_OPOD_20180522T120730_V20180501T225942_20180503T005942.EOF"
+        bad_name = "S1A_OPER_AUX_POEORB_OPOD_20180609T120730_V20180519T225942_20180521T005942.EOF"
+        base_url = "https://s1qc.asf.alaska.edu/aux_poeorb/"
+        get_download_urls.return_value = [base_url + bad_name, base_url + good_name]
+        responses.add(responses.GET, base_url + bad_name, status=500)
+        responses.add(responses.GET, base_url + good_name, body=self.sample_eof, status=200)
+
+        orbit_dates = [
+            datetime.datetime(2018, 5, 20, 4, 30, 26),
+            datetime.datetime(2018, 5, 2, 4, 30, 26),
+        ]
+        try:
+            temp_dir = tempfile.mkdtemp()
+            filenames = download.download_eofs(
+                orbit_dates, missions=["S1A", "S1A"], save_dir=temp_dir
+            )
+            # The failed download is logged and skipped, the other one is kept
+            self.assertEqual(filenames, [os.path.join(temp_dir, good_name)])
+        finally:
+            shutil.rmtree(temp_dir)
+
     def test_main_nothing_found(self):
         # Test "no sentinel products found"
         self.assertEqual(download.main(search_path="/notreal"), 0)